@@ -1,8 +1,9 @@
 import logging
-from model.pg_connections.dev_main import process_parquet_to_postgres
+import os
+from model.pg_connections.dev_main import iter_parquet_to_postgres, plan_partitions
 from services.utils import check_for_files
-from services.transformations.main import transform_data
-from model.google_connections.bigquery import load_dataframes_to_bigquery
+from services.transformations.main import iter_transformed_data
+from model.google_connections.bigquery import load_dataframes_to_bigquery, table_keys
 from services.get_order_proof_data import get_order_proof_data
 
 directory_path = "elt/data/unprocessed_parquets"  # Directory to check for parquet files
@@ -10,7 +11,9 @@ destination_dir = (
     "elt/data/processed_parquets"  # Destination directory for processed files
 )
 table_name = "raw_parquet_orders"  # Replace with your desired table name
-batch_size = 25000  # Define the batch size for loading
+cdc_mode = True  # Also ingest corrected rows from re-delivered parquet files
+memory_budget_mb = os.getenv("ELT_MEMORY_BUDGET_MB")  # Spill to disk above this budget
+memory_budget_bytes = int(memory_budget_mb) * 1024 * 1024 if memory_budget_mb else None
 log_file_path = "elt/parquet_to_pg/parquet_process.log"  # Log file path
 
 log_file_path = "elt/main.log"
@@ -40,18 +43,28 @@ for parquet_file_path in parquet_file_paths:
     logging.info(f"Running for {parquet_file_path}")
 
     # Step 2: Process the parquet file and load it into PostgreSQL
-    new_data_df = process_parquet_to_postgres(parquet_file_path, table_name, batch_size)
-
-    if not new_data_df.empty:
-        logging.info("parquet processing completed successfully.")
-
-        load_data = transform_data(new_data_df)
+    # Above the memory budget, each on-disk partition flows through all steps on its own
+    n_partitions = None
+    if memory_budget_bytes is not None:
+        n_partitions = plan_partitions(
+            parquet_file_path, table_name, memory_budget_bytes, cdc=cdc_mode
+        )
+    new_data_parts = iter_parquet_to_postgres(
+        parquet_file_path,
+        table_name,
+        cdc=cdc_mode,
+        memory_budget_bytes=memory_budget_bytes,
+        n_partitions=n_partitions,
+    )
 
+    # In CDC mode, rows derived from changed orders replace their previous version in BigQuery
+    # Terminals and customers are deduplicated across partitions (first row in the file wins)
+    for load_data, replace_keys in iter_transformed_data(
+        new_data_parts, table_keys, n_partitions, cdc=cdc_mode
+    ):
         logging.info("Data transformation completed successfully.")
 
         # Step 3: Load the transformed data into BigQuery
         logging.info("Starting data loading to BigQuery...")
-        load_dataframes_to_bigquery(load_data, batch_size)
+        load_dataframes_to_bigquery(load_data, replace_keys=replace_keys)
         logging.info("Data loading to BigQuery completed successfully.")
-    else:
-        logging.error("parquet processing skipped.")
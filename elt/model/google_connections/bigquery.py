@@ -1,8 +1,10 @@
 from google.cloud import bigquery
 import os
+import uuid
 import pandas_gbq
 from dotenv import load_dotenv
 import logging
+from services.batching import AdaptiveBatchSizer
 
 load_dotenv()
 
@@ -24,6 +26,14 @@ client = bigquery.Client()
 project_id = os.getenv("BIGQUERY_PROJECT_ID")
 dataset_name = os.getenv("BIGQUERY_DATASET")
 
+# Coluna que identifica unicamente os registros de cada tabela
+table_keys = {
+    "orders": "order_number",
+    "terminals": "terminal_serial_number",
+    "customers": "customer_id",
+    "order_proofs": "order_number",
+}
+
 
 def table_exists_in_bigquery(table_name):
     """
@@ -43,66 +53,165 @@ def table_exists_in_bigquery(table_name):
         return False
 
 
-def get_existing_data(table_name, column_name):
+def get_existing_data(table_name, column_name, values=None, chunk_size=10000):
     """
     Recupera os dados existentes de uma coluna específica de uma tabela no BigQuery.
 
     :param table_name: Nome da tabela.
     :param column_name: Nome da coluna a ser recuperada.
+    :param values: Se informado, recupera apenas os valores da coluna que estão nesta lista,
+        em vez de baixar a coluna inteira.
+    :param chunk_size: Quantidade de valores por consulta quando values é informado.
     :return: Lista de valores existentes nessa coluna.
     """
-    if table_exists_in_bigquery(table_name):
-        query = f"SELECT {column_name} FROM `{project_id}.{dataset_name}.{table_name}`"
+    if not table_exists_in_bigquery(table_name):
+        logging.warning(
+            f"Tabela {table_name} não existe. Nenhum dado existente para recuperar."
+        )
+        return []
+
+    query = f"SELECT {column_name} FROM `{project_id}.{dataset_name}.{table_name}`"
+    if values is None:
         df = client.query(query).result().to_dataframe()
         logging.info(
             f"Dados existentes recuperados da tabela {table_name} no BigQuery."
         )
         return df[column_name].tolist()
-    else:
-        logging.warning(
-            f"Tabela {table_name} não existe. Nenhum dado existente para recuperar."
+
+    # O tipo do parâmetro segue o schema da coluna no BigQuery
+    column_type = get_table_schema(table_name, [column_name])[0]["type"]
+    query = f"{query} WHERE {column_name} IN UNNEST(@values)"
+    existing = []
+    for i in range(0, len(values), chunk_size):
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter(
+                    "values", column_type, list(values[i : i + chunk_size])
+                )
+            ]
         )
-        return []
+        df = client.query(query, job_config=job_config).result().to_dataframe()
+        existing.extend(df[column_name].tolist())
+    logging.info(
+        f"{len(existing)} de {len(values)} valores já existem na tabela {table_name} no BigQuery."
+    )
+    return existing
+
+
+def get_table_schema(table_name, columns):
+    """
+    Recupera o schema de uma tabela do BigQuery, restrito às colunas informadas.
+
+    :param table_name: Nome da tabela.
+    :param columns: Colunas que devem constar no schema.
+    :return: Lista de campos no formato aceito pelo pandas_gbq (table_schema).
+    """
+    table = client.get_table(f"{project_id}.{dataset_name}.{table_name}")
+    return [field.to_api_repr() for field in table.schema if field.name in columns]
+
+
+def append_dataframe_to_bigquery(
+    df, table_name, batch_size=None, destination_table=None, table_schema=None
+):
+    """
+    Anexa um DataFrame a uma tabela no BigQuery em lotes adaptativos.
 
+    :param df: DataFrame a ser carregado.
+    :param table_name: Nome da tabela (usado também para lembrar o tamanho do lote).
+    :param batch_size: Tamanho inicial do lote, usado apenas se não houver tamanho lembrado para a tabela.
+    :param destination_table: Tabela onde os dados são gravados, se diferente de table_name (ex.: staging).
+    :param table_schema: Schema opcional da tabela de destino; se omitido, é inferido do DataFrame.
+    """
+    destination_table = destination_table or table_name
+    batch_sizer = AdaptiveBatchSizer(f"bigquery.{table_name}", initial_size=batch_size)
+    batch_sizer.run(
+        df,
+        lambda batch_df: pandas_gbq.to_gbq(
+            batch_df,
+            destination_table=f"{dataset_name}.{destination_table}",
+            project_id=client.project,
+            if_exists="append",
+            chunksize=None,
+            table_schema=table_schema,
+        ),
+    )
+
+
+def upsert_dataframe_to_bigquery(df, table_name, key_column, batch_size=None):
+    """
+    Substitui atomicamente no BigQuery os registros do DataFrame (modo CDC).
 
-def load_dataframes_to_bigquery(dfs, batch_size=50000):
+    Os dados são carregados em uma tabela de staging e aplicados com um único MERGE,
+    de modo que uma falha na carga nunca deixa registros removidos sem a nova versão.
+
+    :param df: DataFrame com as novas versões dos registros.
+    :param table_name: Nome da tabela de destino.
+    :param key_column: Coluna que identifica unicamente os registros.
+    :param batch_size: Tamanho inicial do lote, usado apenas se não houver tamanho lembrado para a tabela.
+    """
+    df = df.drop_duplicates(subset=key_column, keep="last")
+    if not table_exists_in_bigquery(table_name):
+        append_dataframe_to_bigquery(df, table_name, batch_size)
+        return
+
+    # A staging usa o schema da tabela de destino, e não o inferido das linhas alteradas,
+    # para que o MERGE não falhe por tipos divergentes (ex.: FLOAT64 x INT64)
+    table_schema = get_table_schema(table_name, df.columns)
+    staging_table = f"{table_name}_staging_{uuid.uuid4().hex}"
+    try:
+        append_dataframe_to_bigquery(
+            df, table_name, batch_size, staging_table, table_schema
+        )
+
+        columns = list(df.columns)
+        update_set = ", ".join(f"{column} = S.{column}" for column in columns)
+        column_list = ", ".join(columns)
+        query = (
+            f"MERGE `{project_id}.{dataset_name}.{table_name}` T "
+            f"USING `{project_id}.{dataset_name}.{staging_table}` S "
+            f"ON T.{key_column} = S.{key_column} "
+            f"WHEN MATCHED THEN UPDATE SET {update_set} "
+            f"WHEN NOT MATCHED THEN INSERT ({column_list}) VALUES ({column_list})"
+        )
+        client.query(query).result()
+        logging.info(
+            f"{len(df)} registros alterados substituídos na tabela {table_name} no BigQuery."
+        )
+    finally:
+        client.delete_table(
+            f"{project_id}.{dataset_name}.{staging_table}", not_found_ok=True
+        )
+
+
+def load_dataframes_to_bigquery(dfs, batch_size=None, replace_keys=None):
     """
     Carrega múltiplos DataFrames do Pandas para suas respectivas tabelas no BigQuery,
     garantindo que nenhum registro duplicado seja inserido.
 
     :param dfs: Dicionário onde as chaves são os nomes das tabelas e os valores são DataFrames do Pandas a serem carregados.
-    :param batch_size: Número de linhas a serem processadas por vez (padrão: 50000).
+    :param batch_size: Tamanho inicial do lote, usado apenas se não houver tamanho lembrado para a tabela.
+    :param replace_keys: Dicionário opcional {tabela: lista de chaves} com registros alterados (modo CDC),
+        que substituem atomicamente as versões existentes no BigQuery.
     """
+    replace_keys = replace_keys or {}
     for table_name, df in dfs.items():
-        if table_name == "orders":
-            existing_order_numbers = get_existing_data("orders", "order_number")
-            df = df[~df["order_number"].isin(existing_order_numbers)]
-
-        elif table_name == "terminals":
-            existing_terminal_serial_numbers = get_existing_data(
-                "terminals", "terminal_serial_number"
+        key_column = table_keys.get(table_name)
+        if key_column is not None:
+            if replace_keys.get(table_name):
+                is_replaced = df[key_column].isin(replace_keys[table_name])
+                upsert_dataframe_to_bigquery(
+                    df[is_replaced], table_name, key_column, batch_size
+                )
+                df = df[~is_replaced]
+            # Consulta apenas as chaves deste lote, e não a coluna inteira da tabela
+            existing_keys = get_existing_data(
+                table_name, key_column, df[key_column].dropna().unique().tolist()
             )
-            df = df[
-                ~df["terminal_serial_number"].isin(existing_terminal_serial_numbers)
-            ]
-
-        elif table_name == "customers":
-            existing_customer_ids = get_existing_data("customers", "customer_id")
-            df = df[~df["customer_id"].isin(existing_customer_ids)]
+            df = df[~df[key_column].isin(existing_keys)]
 
-        elif table_name == "order_proofs":
-            existing_order_numbers = get_existing_data("order_proofs", "order_number")
-            df = df[~df["order_number"].isin(existing_order_numbers)]
-
-        # Carrega o DataFrame filtrado para o BigQuery em lotes
+        # Carrega o DataFrame filtrado para o BigQuery em lotes adaptativos
         if not df.empty:
-            pandas_gbq.to_gbq(
-                df,
-                destination_table=f"{dataset_name}.{table_name}",
-                project_id=client.project,
-                if_exists="append",
-                chunksize=batch_size,
-            )
+            append_dataframe_to_bigquery(df, table_name, batch_size)
             logging.info(
                 f"Lote de dados carregado com sucesso em {dataset_name}.{table_name}."
             )
@@ -1,8 +1,24 @@
 import pandas as pd
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import bindparam, create_engine, inspect, text
 import logging
 from dotenv import load_dotenv
 import os
+from services.batching import AdaptiveBatchSizer, PG_MAX_PARAMS
+from services.cdc import (
+    classify_changes,
+    compute_row_hash,
+    hash_column,
+    operation_column,
+)
+from services.spill import (
+    choose_chunk_rows,
+    choose_partitions,
+    estimate_parquet_memory,
+    iter_parquet_chunks,
+    sample_rows,
+    SpillPartitioner,
+    working_copies,
+)
 
 load_dotenv()
 
@@ -14,7 +30,6 @@ destination_dir = (
     "elt/data/processed_parquets"  # Diretório de destino para arquivos processados
 )
 table_name = "raw_parquet_orders"  # Substitua pelo nome da tabela desejada
-batch_size = 1000  # Definir o tamanho do lote para carregamento
 log_file_path = (
     "elt/model/pg_connections/parquet_process.log"  # Caminho do arquivo de log
 )
@@ -48,22 +63,27 @@ def table_exists(engine, table_name):
     return inspector.has_table(table_name)
 
 
-def load_existing_data_from_pg(engine):
+def load_existing_data_from_pg(engine, chunksize=None, limit=None):
     """
     Carrega os números de pedido existentes da tabela PostgreSQL, se existir.
 
     :param engine: Objeto engine do SQLAlchemy.
+    :param chunksize: Se informado, retorna um iterador de DataFrames com esse número de linhas.
+    :param limit: Se informado, carrega no máximo esse número de linhas (amostra).
     :return: DataFrame com os números de pedido existentes.
     """
     if table_exists(engine, table_name):
         query = f"SELECT order_number FROM {table_name}"
-        existing_df = pd.read_sql_query(query, engine)
+        if limit is not None:
+            query = f"{query} LIMIT {int(limit)}"
+        existing_df = pd.read_sql_query(query, engine, chunksize=chunksize)
         return existing_df
     else:
         logging.info(
             f"Tabela {table_name} não existe. Pulando carregamento de dados existentes."
         )
-        return pd.DataFrame(columns=["order_number"])
+        existing_df = pd.DataFrame(columns=["order_number"])
+        return existing_df if chunksize is None else iter([existing_df])
 
 
 def filter_new_data(df, existing_df):
@@ -78,13 +98,205 @@ def filter_new_data(df, existing_df):
     return new_data
 
 
-def process_parquet_to_postgres(parquet_file, table_name, batch_size):
+def load_existing_hashes_from_pg(engine, table_name, chunksize=None, limit=None):
+    """
+    Carrega os números de pedido e os hashes de linha existentes na tabela PostgreSQL, se existir.
+
+    :param engine: Objeto engine do SQLAlchemy.
+    :param table_name: Nome da tabela no PostgreSQL.
+    :param chunksize: Se informado, retorna um iterador de DataFrames com esse número de linhas.
+    :param limit: Se informado, carrega no máximo esse número de linhas (amostra).
+    :return: DataFrame com as colunas order_number e row_hash (nulo para linhas anteriores ao modo CDC).
+    """
+    if not table_exists(engine, table_name):
+        logging.info(
+            f"Tabela {table_name} não existe. Pulando carregamento de hashes existentes."
+        )
+        existing_df = pd.DataFrame(
+            {"order_number": [], hash_column: pd.Series([], dtype="Int64")}
+        )
+        return existing_df if chunksize is None else iter([existing_df])
+
+    columns = [column["name"] for column in inspect(engine).get_columns(table_name)]
+    hash_expression = (
+        hash_column if hash_column in columns else f"NULL AS {hash_column}"
+    )
+    query = f"SELECT order_number, {hash_expression} FROM {table_name}"
+    if limit is not None:
+        query = f"{query} LIMIT {int(limit)}"
+    return pd.read_sql_query(
+        query, engine, dtype={hash_column: "Int64"}, chunksize=chunksize
+    )
+
+
+def filter_changed_data(df, existing_df):
+    """
+    Filtra as linhas do parquet que são novas ou que mudaram em relação ao PostgreSQL.
+
+    :param df: DataFrame com os dados do parquet.
+    :param existing_df: DataFrame com os números de pedido e hashes existentes no PostgreSQL.
+    :return: DataFrame com as linhas novas e alteradas, com as colunas row_hash e cdc_operation.
+    """
+    df = df.copy()
+    df[hash_column] = compute_row_hash(df)
+    classified = classify_changes(df, existing_df)
+    return classified[classified[operation_column] != "unchanged"]
+
+
+def delete_rows_from_pg(connection, table_name, order_numbers, chunk_size=10000):
+    """
+    Remove da tabela PostgreSQL as linhas com os números de pedido informados.
+
+    :param connection: Conexão do SQLAlchemy (dentro de uma transação).
+    :param table_name: Nome da tabela no PostgreSQL.
+    :param order_numbers: Lista de números de pedido a remover.
+    :param chunk_size: Quantidade de números de pedido por comando DELETE.
+    """
+    statement = text(
+        f"DELETE FROM {table_name} WHERE order_number IN :order_numbers"
+    ).bindparams(bindparam("order_numbers", expanding=True))
+    for i in range(0, len(order_numbers), chunk_size):
+        connection.execute(
+            statement, {"order_numbers": list(order_numbers[i : i + chunk_size])}
+        )
+
+
+def estimate_existing_memory(engine, table_name, cdc=False):
+    """
+    Estima a memória que as chaves existentes no PostgreSQL ocuparão no pandas, sem lê-las
+    por inteiro: o total de linhas vem de um count(*) e o tamanho por linha de uma amostra.
+
+    :param engine: Objeto engine do SQLAlchemy.
+    :param table_name: Nome da tabela no PostgreSQL.
+    :param cdc: Se True, considera também a coluna de hash carregada no modo CDC.
+    :return: Tupla (bytes estimados, número de linhas).
+    """
+    if not table_exists(engine, table_name):
+        return 0, 0
+
+    with engine.connect() as connection:
+        n_rows = connection.execute(text(f"SELECT count(*) FROM {table_name}")).scalar()
+    if n_rows == 0:
+        return 0, 0
+
+    if cdc:
+        sample_df = load_existing_hashes_from_pg(engine, table_name, limit=sample_rows)
+    else:
+        sample_df = load_existing_data_from_pg(engine, limit=sample_rows)
+    bytes_per_row = sample_df.memory_usage(index=True, deep=True).sum() / len(sample_df)
+    return int(bytes_per_row * n_rows), n_rows
+
+
+def plan_partitions(parquet_file, table_name, memory_budget_bytes, cdc=False):
+    """
+    Decide se o arquivo parquet deve ser processado em memória ou particionado em disco.
+
+    O caminho em memória mantém o arquivo e as chaves existentes no PostgreSQL ao mesmo
+    tempo, com as cópias de trabalho dos filtros, então ambos entram na estimativa.
+
+    :param parquet_file: Caminho do arquivo parquet.
+    :param table_name: Nome da tabela no PostgreSQL.
+    :param memory_budget_bytes: Orçamento de memória, em bytes.
+    :param cdc: Se True, considera também a coluna de hash carregada no modo CDC.
+    :return: Número de partições em disco, ou None se os dados couberem no orçamento.
+    """
+    engine = create_pg_engine()
+    file_bytes, file_rows = estimate_parquet_memory(parquet_file)
+    existing_bytes, existing_rows = estimate_existing_memory(engine, table_name, cdc)
+    estimated_bytes = file_bytes + existing_bytes
+    logging.info(
+        f"Arquivo parquet com {file_rows} registros (~{file_bytes} bytes) e {existing_rows} "
+        f"chaves existentes no PostgreSQL (~{existing_bytes} bytes)"
+    )
+    if estimated_bytes * working_copies <= memory_budget_bytes:
+        return None
+    return choose_partitions(estimated_bytes, memory_budget_bytes)
+
+
+def create_pg_engine():
+    """
+    Cria a conexão com o banco de dados PostgreSQL a partir das variáveis de ambiente.
+
+    :return: Objeto engine do SQLAlchemy.
+    """
+    logging.info(
+        f"Criando conexão com o banco de dados PostgreSQL em {postgres_host}:{postgres_port}"
+    )
+    return create_engine(
+        f"postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_db}"
+    )
+
+
+def write_new_data_to_pg(engine, new_data, table_name, batch_size=None, cdc=False):
+    """
+    Grava no PostgreSQL, em uma transação, as linhas novas (e, no modo CDC, as alteradas).
+
+    :param engine: Objeto engine do SQLAlchemy.
+    :param new_data: DataFrame com as linhas filtradas.
+    :param table_name: Nome da tabela no PostgreSQL.
+    :param batch_size: Tamanho inicial do lote, usado apenas se não houver tamanho lembrado para a tabela.
+    :param cdc: Se True, new_data contém as colunas row_hash e cdc_operation.
+    """
+    if new_data.empty:
+        logging.info("Nenhum dado novo para carregar.")
+        return
+
+    if cdc:
+        raw_data = new_data.drop(columns=[operation_column])
+        updated_order_numbers = new_data.loc[
+            new_data[operation_column] == "update", "order_number"
+        ].tolist()
+    else:
+        raw_data = new_data
+        updated_order_numbers = []
+
+    # Carregamento em lotes na tabela PostgreSQL dentro de uma transação
+    # O tamanho do lote é limitado pelo número de parâmetros por comando (method="multi")
+    batch_sizer = AdaptiveBatchSizer(
+        table_name, initial_size=batch_size, max_params=PG_MAX_PARAMS
+    )
+    logging.info(
+        f"Iniciando inserção em lotes com tamanho inicial de {batch_sizer.batch_size}"
+    )
+    with engine.begin() as connection:  # Gerenciamento explícito de transação
+        if cdc and table_exists(connection, table_name):
+            connection.execute(
+                text(
+                    f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {hash_column} BIGINT"
+                )
+            )
+        if updated_order_numbers:
+            logging.info(
+                f"Substituindo {len(updated_order_numbers)} registros alterados na tabela {table_name}"
+            )
+            delete_rows_from_pg(connection, table_name, updated_order_numbers)
+
+        batch_sizer.run(
+            raw_data,
+            lambda batch_df: batch_df.to_sql(
+                table_name,
+                connection,
+                if_exists="append",
+                index=False,
+                method="multi",
+            ),
+        )
+
+    logging.info(f"Dados carregados com sucesso na tabela {table_name} no PostgreSQL")
+
+
+def process_parquet_to_postgres(parquet_file, table_name, batch_size=None, cdc=False):
     """
-    Processa o arquivo parquet e carrega os dados no PostgreSQL em lotes.
+    Processa o arquivo parquet e carrega os dados no PostgreSQL em lotes adaptativos.
+
+    No modo CDC, cada linha recebe um hash; linhas novas são inseridas, linhas alteradas
+    substituem as existentes e linhas inalteradas são descartadas.
 
     :param parquet_file: Caminho do arquivo parquet.
     :param table_name: Nome da tabela no PostgreSQL.
-    :param batch_size: Tamanho do lote para inserção dos dados.
+    :param batch_size: Tamanho inicial do lote, usado apenas se não houver tamanho lembrado para a tabela.
+    :param cdc: Se True, ingere também as linhas alteradas (modo CDC).
+    :return: DataFrame com as linhas carregadas; no modo CDC inclui as colunas row_hash e cdc_operation.
     """
     try:
         logging.info(
@@ -92,12 +304,7 @@ def process_parquet_to_postgres(parquet_file, table_name, batch_size):
         )
 
         # Criar uma conexão com o banco de dados PostgreSQL
-        logging.info(
-            f"Criando conexão com o banco de dados PostgreSQL em {postgres_host}:{postgres_port}"
-        )
-        engine = create_engine(
-            f"postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_db}"
-        )
+        engine = create_pg_engine()
 
         # Ler o arquivo parquet em um DataFrame
         logging.info(f"Lendo o arquivo parquet de {parquet_file}")
@@ -108,37 +315,123 @@ def process_parquet_to_postgres(parquet_file, table_name, batch_size):
         logging.info(
             f"Verificando se a tabela {table_name} existe e carregando dados existentes, se disponíveis"
         )
-        existing_df = load_existing_data_from_pg(engine)
-
-        # Filtrar os dados que já existem na tabela PostgreSQL
-        logging.info("Filtrando registros já presentes na tabela PostgreSQL")
-        new_data = filter_new_data(df, existing_df)
-
-        if not new_data.empty:
-            # Carregamento em lotes na tabela PostgreSQL dentro de uma transação
-            logging.info(f"Iniciando inserção em lotes com tamanho de {batch_size}")
-            with engine.begin() as connection:  # Gerenciamento explícito de transação
-                for i in range(0, len(new_data), batch_size):
-                    batch_df = new_data[i : i + batch_size]
-                    logging.info(
-                        f"Inserindo registros de {i} a {i + len(batch_df)} na tabela PostgreSQL: {table_name}"
-                    )
-                    batch_df.to_sql(
-                        table_name,
-                        connection,
-                        if_exists="append",
-                        index=False,
-                        method="multi",
-                    )
+        if cdc:
+            existing_df = load_existing_hashes_from_pg(engine, table_name)
 
-            logging.info(
-                f"Dados carregados com sucesso na tabela {table_name} no PostgreSQL"
-            )
+            # Classificar as linhas em novas, alteradas e inalteradas
+            logging.info("Classificando registros em relação à tabela PostgreSQL (CDC)")
+            new_data = filter_changed_data(df, existing_df)
         else:
-            logging.info("Nenhum dado novo para carregar.")
+            existing_df = load_existing_data_from_pg(engine)
+
+            # Filtrar os dados que já existem na tabela PostgreSQL
+            logging.info("Filtrando registros já presentes na tabela PostgreSQL")
+            new_data = filter_new_data(df, existing_df)
+
+        write_new_data_to_pg(engine, new_data, table_name, batch_size, cdc)
 
         return new_data
 
     except Exception as e:
         logging.error(f"Ocorreu um erro durante o processamento: {e}")
         raise  # Re-lançar a exceção para tratá-la posteriormente, se necessário
+
+
+def process_parquet_to_postgres_out_of_core(
+    parquet_file,
+    table_name,
+    n_partitions,
+    memory_budget_bytes,
+    batch_size=None,
+    cdc=False,
+):
+    """
+    Processa um arquivo parquet maior que o orçamento de memória, uma partição por vez.
+
+    O arquivo e as chaves existentes no PostgreSQL são lidos em blocos e particionados
+    por hash de order_number em disco. Cada partição é filtrada (filter_new_data ou
+    filter_changed_data), gravada no PostgreSQL e entregue ao chamador antes da próxima
+    ser lida, de modo que nenhuma etapa mantém o arquivo inteiro em memória.
+
+    :param parquet_file: Caminho do arquivo parquet.
+    :param table_name: Nome da tabela no PostgreSQL.
+    :param n_partitions: Número de partições em disco (ver plan_partitions).
+    :param memory_budget_bytes: Orçamento de memória, em bytes.
+    :param batch_size: Tamanho inicial do lote, usado apenas se não houver tamanho lembrado para a tabela.
+    :param cdc: Se True, ingere também as linhas alteradas (modo CDC).
+    :return: Gerador com as linhas carregadas de cada partição.
+    """
+    try:
+        engine = create_pg_engine()
+
+        # Cada lado é lido em blocos dimensionados pelo seu próprio tamanho por linha
+        file_bytes, file_rows = estimate_parquet_memory(parquet_file)
+        existing_bytes, existing_rows = estimate_existing_memory(
+            engine, table_name, cdc
+        )
+        file_chunk_rows = choose_chunk_rows(file_bytes, file_rows, memory_budget_bytes)
+        existing_chunk_rows = choose_chunk_rows(
+            existing_bytes, existing_rows, memory_budget_bytes
+        )
+        logging.info(
+            f"Dados excedem o orçamento de memória; processando em {n_partitions} "
+            f"partições em disco"
+        )
+
+        with SpillPartitioner("order_number", n_partitions) as partitioner:
+            for chunk in iter_parquet_chunks(parquet_file, file_chunk_rows):
+                partitioner.add("left", chunk)
+
+            # Cursor no servidor para que as chaves existentes também sejam lidas em blocos
+            with engine.connect().execution_options(stream_results=True) as connection:
+                if cdc:
+                    existing_chunks = load_existing_hashes_from_pg(
+                        connection, table_name, chunksize=existing_chunk_rows
+                    )
+                else:
+                    existing_chunks = load_existing_data_from_pg(
+                        connection, chunksize=existing_chunk_rows
+                    )
+                for chunk in existing_chunks:
+                    partitioner.add("right", chunk)
+
+            operator = filter_changed_data if cdc else filter_new_data
+            for new_data in partitioner.apply(operator):
+                if new_data.empty:
+                    continue
+                write_new_data_to_pg(engine, new_data, table_name, batch_size, cdc)
+                yield new_data
+
+    except Exception as e:
+        logging.error(f"Ocorreu um erro durante o processamento: {e}")
+        raise  # Re-lançar a exceção para tratá-la posteriormente, se necessário
+
+
+def iter_parquet_to_postgres(
+    parquet_file,
+    table_name,
+    batch_size=None,
+    cdc=False,
+    memory_budget_bytes=None,
+    n_partitions=None,
+):
+    """
+    Processa o arquivo parquet e entrega as linhas carregadas no PostgreSQL em partes.
+
+    Sem partições (n_partitions None), é entregue uma única parte com o resultado de
+    process_parquet_to_postgres; caso contrário, uma parte por partição em disco.
+
+    :param parquet_file: Caminho do arquivo parquet.
+    :param table_name: Nome da tabela no PostgreSQL.
+    :param batch_size: Tamanho inicial do lote, usado apenas se não houver tamanho lembrado para a tabela.
+    :param cdc: Se True, ingere também as linhas alteradas (modo CDC).
+    :param memory_budget_bytes: Orçamento de memória, em bytes (obrigatório com n_partitions).
+    :param n_partitions: Número de partições calculado com plan_partitions (None para processar em memória).
+    :return: Gerador de DataFrames com as linhas carregadas.
+    """
+    if n_partitions is not None:
+        yield from process_parquet_to_postgres_out_of_core(
+            parquet_file, table_name, n_partitions, memory_budget_bytes, batch_size, cdc
+        )
+    else:
+        yield process_parquet_to_postgres(parquet_file, table_name, batch_size, cdc)
@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import time
+
+# Arquivo onde o melhor tamanho de lote de cada tabela é guardado entre execuções
+state_file_path = "elt/data/batch_sizes.json"
+
+# Limite de parâmetros por comando do protocolo do PostgreSQL (method="multi")
+PG_MAX_PARAMS = 65535
+
+# Orçamento de memória padrão para um único lote (256 MB)
+DEFAULT_MEMORY_BUDGET_BYTES = 256 * 1024 * 1024
+
+
+def load_batch_state(state_path=state_file_path):
+    """
+    Carrega o estado persistido dos tamanhos de lote por tabela.
+
+    :param state_path: Caminho do arquivo JSON de estado.
+    :return: Dicionário {tabela: {"batch_size": int, "rows_per_sec": float}}.
+    """
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Não foi possível ler o estado de lotes em {state_path}: {e}")
+        return {}
+
+
+def save_batch_state(state, state_path=state_file_path):
+    """
+    Persiste o estado dos tamanhos de lote por tabela.
+
+    :param state: Dicionário com o estado a ser salvo.
+    :param state_path: Caminho do arquivo JSON de estado.
+    """
+    directory = os.path.dirname(state_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(state_path, "w") as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+
+
+class AdaptiveBatchSizer:
+    """
+    Controla o tamanho dos lotes de inserção de uma tabela a partir da vazão medida.
+
+    A cada lote são medidas a latência e a vazão (linhas/s). O tamanho cresce
+    enquanto a vazão melhora e recua quando ela piora ou quando a latência passa
+    do alvo, sempre respeitando os limites de memória e de parâmetros por comando.
+    O melhor tamanho observado é lembrado por tabela entre execuções.
+    """
+
+    def __init__(
+        self,
+        table_name,
+        initial_size=None,
+        min_size=100,
+        max_size=100000,
+        max_params=None,
+        memory_budget_bytes=DEFAULT_MEMORY_BUDGET_BYTES,
+        target_latency=30.0,
+        growth_factor=2.0,
+        state_path=state_file_path,
+    ):
+        """
+        :param table_name: Nome da tabela de destino (chave do estado persistido).
+        :param initial_size: Tamanho inicial caso não haja estado salvo (padrão: min_size * 10).
+        :param min_size: Menor tamanho de lote permitido.
+        :param max_size: Maior tamanho de lote permitido.
+        :param max_params: Máximo de parâmetros por comando (ex.: PG_MAX_PARAMS), ou None.
+        :param memory_budget_bytes: Memória máxima que um lote pode ocupar.
+        :param target_latency: Latência máxima desejada por lote, em segundos.
+        :param growth_factor: Fator multiplicativo usado para crescer ou reduzir o lote.
+        :param state_path: Caminho do arquivo JSON de estado.
+        """
+        self.table_name = table_name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_params = max_params
+        self.memory_budget_bytes = memory_budget_bytes
+        self.target_latency = target_latency
+        self.growth_factor = growth_factor
+        self.state_path = state_path
+
+        self.state = load_batch_state(state_path)
+        remembered = self.state.get(table_name, {})
+        self.best_size = remembered.get("batch_size")
+        # A vazão é medida novamente a cada execução, pois a carga e a largura das linhas mudam
+        self.best_rows_per_sec = 0.0
+
+        if self.best_size is not None:
+            self.batch_size = self.best_size
+        elif initial_size is not None:
+            self.batch_size = initial_size
+        else:
+            self.batch_size = min_size * 10
+        self.batch_size = max(self.min_size, min(self.batch_size, self.max_size))
+
+        self._direction = 1
+        self._last_rows_per_sec = None
+        self._limit = self.max_size
+
+    def compute_limit(self, df):
+        """
+        Calcula o maior tamanho de lote permitido para o DataFrame informado.
+
+        :param df: DataFrame a ser carregado.
+        :return: Número máximo de linhas por lote.
+        """
+        limit = self.max_size
+        if len(df) > 0 and self.memory_budget_bytes is not None:
+            row_bytes = df.memory_usage(index=False, deep=True).sum() / len(df)
+            if row_bytes > 0:
+                limit = min(limit, int(self.memory_budget_bytes // row_bytes))
+        limit = max(self.min_size, limit)
+
+        # O limite de parâmetros é rígido: prevalece inclusive sobre o tamanho mínimo
+        if self.max_params is not None:
+            n_columns = max(len(df.columns), 1)
+            limit = min(limit, max(1, self.max_params // n_columns))
+        return limit
+
+    def record(self, rows, elapsed):
+        """
+        Registra a medição de um lote e ajusta o tamanho do próximo.
+
+        :param rows: Número de linhas inseridas no lote.
+        :param elapsed: Tempo gasto na inserção, em segundos.
+        """
+        rows_per_sec = rows / elapsed if elapsed > 0 else float("inf")
+        logging.info(
+            f"Lote de {rows} linhas em {self.table_name}: {elapsed:.3f}s ({rows_per_sec:.0f} linhas/s)"
+        )
+
+        # Lotes parciais (fim dos dados) não são representativos para o ajuste
+        if rows < self.batch_size:
+            return
+
+        if rows_per_sec > self.best_rows_per_sec:
+            self.best_rows_per_sec = rows_per_sec
+            self.best_size = self.batch_size
+
+        if elapsed > self.target_latency:
+            self._direction = -1
+        elif (
+            self._last_rows_per_sec is not None
+            and rows_per_sec < self._last_rows_per_sec
+        ):
+            self._direction = -self._direction
+        self._last_rows_per_sec = rows_per_sec
+
+        if self._direction > 0:
+            new_size = int(self.batch_size * self.growth_factor)
+        else:
+            new_size = int(self.batch_size / self.growth_factor)
+        self.batch_size = min(max(self.min_size, new_size), self._limit)
+
+    def save(self):
+        """
+        Persiste o melhor tamanho de lote observado para a tabela.
+        """
+        if self.best_rows_per_sec == 0.0:
+            return
+        self.state = load_batch_state(self.state_path)
+        self.state[self.table_name] = {
+            "batch_size": self.best_size,
+            "rows_per_sec": self.best_rows_per_sec,
+        }
+        save_batch_state(self.state, self.state_path)
+
+    def run(self, df, insert_fn):
+        """
+        Insere o DataFrame em lotes adaptativos usando a função informada.
+
+        :param df: DataFrame a ser carregado.
+        :param insert_fn: Função que recebe um DataFrame (lote) e o insere no destino.
+        :return: Número total de linhas inseridas.
+        """
+        self._limit = self.compute_limit(df)
+        self.batch_size = min(self.batch_size, self._limit)
+
+        start = 0
+        while start < len(df):
+            batch_df = df.iloc[start : start + self.batch_size]
+            logging.info(
+                f"Inserindo registros de {start} a {start + len(batch_df)} na tabela: {self.table_name}"
+            )
+            began = time.perf_counter()
+            insert_fn(batch_df)
+            self.record(len(batch_df), time.perf_counter() - began)
+            start += len(batch_df)
+
+        self.save()
+        return start
@@ -0,0 +1,238 @@
+import logging
+import math
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Coluna auxiliar que guarda o índice original das linhas nas partições em disco
+index_column = "__spill_index"
+
+# Quantas vezes o tamanho de uma partição cabe no orçamento (cópias de trabalho dos operadores)
+working_copies = 4
+
+# Linhas lidas do início do arquivo para estimar a memória ocupada por linha
+sample_rows = 10000
+
+
+def estimate_parquet_memory(parquet_file):
+    """
+    Estima a memória que um arquivo parquet ocupará no pandas, sem lê-lo por inteiro.
+
+    Uma amostra do início do arquivo é convertida para DataFrame e o tamanho medido
+    (memory_usage com deep=True) é extrapolado para o total de linhas.
+
+    :param parquet_file: Caminho do arquivo parquet.
+    :return: Tupla (bytes estimados, número de linhas).
+    """
+    parquet = pq.ParquetFile(parquet_file)
+    n_rows = parquet.metadata.num_rows
+    if n_rows == 0:
+        return 0, 0
+
+    sample = next(parquet.iter_batches(batch_size=min(n_rows, sample_rows)))
+    sample_df = sample.to_pandas()
+    bytes_per_row = sample_df.memory_usage(index=True, deep=True).sum() / len(sample_df)
+    return int(bytes_per_row * n_rows), n_rows
+
+
+def choose_partitions(estimated_bytes, memory_budget_bytes):
+    """
+    Calcula quantas partições são necessárias para que cada uma caiba no orçamento de memória.
+
+    :param estimated_bytes: Tamanho estimado dos dados, em bytes.
+    :param memory_budget_bytes: Orçamento de memória, em bytes.
+    :return: Número de partições (no mínimo 2).
+    """
+    return max(2, math.ceil(estimated_bytes * working_copies / memory_budget_bytes))
+
+
+def choose_chunk_rows(estimated_bytes, n_rows, memory_budget_bytes):
+    """
+    Calcula quantas linhas podem ser lidas por vez respeitando o orçamento de memória.
+
+    :param estimated_bytes: Tamanho estimado dos dados, em bytes.
+    :param n_rows: Número de linhas dos dados.
+    :param memory_budget_bytes: Orçamento de memória, em bytes.
+    :return: Número de linhas por bloco.
+    """
+    bytes_per_row = max(estimated_bytes / max(n_rows, 1), 1)
+    return max(1, int(memory_budget_bytes // (bytes_per_row * working_copies)))
+
+
+def columns_with_nulls(parquet, columns):
+    """
+    Identifica quais colunas do arquivo parquet contêm nulos, lendo apenas essas colunas.
+
+    :param parquet: Objeto pq.ParquetFile.
+    :param columns: Colunas a verificar.
+    :return: Conjunto com as colunas que contêm ao menos um nulo.
+    """
+    if not columns:
+        return set()
+    has_nulls = set()
+    for batch in parquet.iter_batches(columns=columns):
+        for column, values in zip(batch.schema.names, batch.columns):
+            if values.null_count:
+                has_nulls.add(column)
+    return has_nulls
+
+
+def iter_parquet_chunks(parquet_file, chunk_rows):
+    """
+    Lê um arquivo parquet em blocos, com o mesmo índice e os mesmos tipos que
+    pd.read_parquet produziria.
+
+    O pyarrow converte uma coluna inteira (ou booleana) para float64 (ou object) apenas
+    quando há nulos, então cada bloco recebe o tipo que a coluna tem no arquivo inteiro;
+    caso contrário o mesmo valor geraria hashes diferentes em blocos diferentes.
+
+    :param parquet_file: Caminho do arquivo parquet.
+    :param chunk_rows: Número de linhas por bloco.
+    :return: Gerador de DataFrames.
+    """
+    parquet = pq.ParquetFile(parquet_file)
+    nullable_columns = columns_with_nulls(
+        parquet,
+        [
+            field.name
+            for field in parquet.schema_arrow
+            if pa.types.is_integer(field.type) or pa.types.is_boolean(field.type)
+        ],
+    )
+
+    start = 0
+    for batch in parquet.iter_batches(batch_size=chunk_rows):
+        chunk = batch.to_pandas()
+        for column in nullable_columns:
+            dtype = chunk[column].dtype
+            # Tipos estendidos (ex.: Int64 vindo dos metadados do pandas) já são estáveis
+            if isinstance(dtype, np.dtype) and dtype.kind in "iu":
+                chunk[column] = chunk[column].astype("float64")
+            elif isinstance(dtype, np.dtype) and dtype.kind == "b":
+                chunk[column] = chunk[column].astype("object")
+        if isinstance(chunk.index, pd.RangeIndex):
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
+
+
+class SpillPartitioner:
+    """
+    Particiona DataFrames por hash de uma chave em arquivos parquet no disco local,
+    de modo que linhas com a mesma chave caiam sempre na mesma partição.
+    """
+
+    def __init__(self, key, n_partitions, directory=None):
+        """
+        :param key: Coluna usada no particionamento.
+        :param n_partitions: Número de partições.
+        :param directory: Diretório base para os arquivos temporários
+            (padrão: ELT_SPILL_DIR ou o diretório temporário do sistema).
+        """
+        self.key = key
+        self.n_partitions = n_partitions
+        directory = directory or os.getenv("ELT_SPILL_DIR") or None
+        self.directory = tempfile.mkdtemp(prefix="elt_spill_", dir=directory)
+        self._paths = {}
+        self._positions = {}
+        self._schemas = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+    def _partition_of(self, df):
+        keys = df[self.key]
+        # Chaves numéricas iguais precisam cair na mesma partição independentemente do tipo (int, float, Int64)
+        if pd.api.types.is_numeric_dtype(keys):
+            keys = keys.astype("float64")
+        hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+        return hashes % self.n_partitions
+
+    def add(self, name, df):
+        """
+        Grava um bloco de dados nas partições de um lado (ex.: "left" ou "right").
+
+        As linhas recebem a posição global como índice e o índice original é guardado em
+        uma coluna auxiliar, para que a ordem e o índice possam ser restaurados depois.
+
+        :param name: Nome do conjunto de dados.
+        :param df: Bloco de dados.
+        """
+        start = self._positions.get(name, 0)
+        self._positions[name] = start + len(df)
+        df = df.copy()
+        df[index_column] = df.index
+        df.index = pd.RangeIndex(start, start + len(df))
+        self._schemas.setdefault(name, df.iloc[:0])
+
+        partitions = self._partition_of(df)
+        for partition in np.unique(partitions):
+            paths = self._paths.setdefault((name, partition), [])
+            path = os.path.join(
+                self.directory, f"{name}_{partition}_{len(paths)}.parquet"
+            )
+            df[partitions == partition].to_parquet(path)
+            paths.append(path)
+
+    def read(self, name, partition):
+        """
+        Lê uma partição de um conjunto de dados, na ordem original das linhas.
+
+        :param name: Nome do conjunto de dados.
+        :param partition: Número da partição.
+        :return: DataFrame da partição (vazio se não houver linhas).
+        """
+        paths = self._paths.get((name, partition))
+        if not paths:
+            return self.empty(name)
+        return pd.concat([pd.read_parquet(path) for path in paths]).sort_index()
+
+    def empty(self, name):
+        """
+        Retorna um DataFrame vazio com as colunas de um conjunto de dados.
+
+        :param name: Nome do conjunto de dados.
+        :return: DataFrame vazio.
+        """
+        return self._schemas.get(name, pd.DataFrame(columns=[index_column])).copy()
+
+    def apply(self, operator):
+        """
+        Aplica um operador partição a partição, sem nunca juntar as partições em memória.
+
+        O operador recebe, para cada partição, as linhas dos lados "left" e "right" com a
+        mesma chave e deve devolver um subconjunto das linhas de "left" preservando o índice,
+        como um filtro com isin. As linhas de "left" chegam ordenadas pelo índice original
+        (e não pela ordem em que foram adicionadas), de modo que um drop_duplicates mantém
+        a primeira ocorrência no arquivo. Cada resultado mantém o índice original.
+
+        :param operator: Função (left_df, right_df) -> DataFrame filtrado de left_df.
+        :return: Gerador com o resultado de cada partição não vazia.
+        """
+        logging.info(
+            f"Dados particionados em {self.n_partitions} partições em {self.directory}"
+        )
+        for partition in range(self.n_partitions):
+            left = self.read("left", partition)
+            if left.empty:
+                continue
+            left = left.sort_values(index_column, kind="stable")
+            original_index = left.pop(index_column)
+            right = self.read("right", partition).drop(columns=[index_column])
+
+            result = operator(left, right)
+            result.index = pd.Index(original_index.loc[result.index].to_numpy())
+            yield result
+
+    def cleanup(self):
+        """
+        Remove os arquivos temporários das partições.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -1,5 +1,7 @@
 import logging
 import pandas as pd
+from services.cdc import operation_column
+from services.spill import SpillPartitioner
 
 # Nome da tabela no PostgreSQL que contém os dados brutos extraídos do CSV
 table_name = "raw_csv_orders"  # Substitua pelo nome desejado da tabela
@@ -21,18 +23,13 @@ logging.basicConfig(
 )
 
 
-def transform_data(df):
+def transform_terminals(df):
     """
-    Transforma os dados extraídos do PostgreSQL em três tabelas separadas: Terminals, Orders e Customers.
+    Cria a tabela de terminais, com uma linha por número de série (a primeira encontrada).
 
     :param df: DataFrame com os dados extraídos da tabela "raw_data_orders".
-    :return: Dicionário contendo os DataFrames transformados para Terminals, Orders e Customers.
+    :return: DataFrame da tabela Terminals.
     """
-
-    df["arrival_date"] = pd.to_datetime(df["arrival_date"], errors="coerce")
-    df["deadline_date"] = pd.to_datetime(df["deadline_date"], errors="coerce")
-
-    # Tabela de Terminais
     terminals_df = df[
         [
             "terminal_serial_number",
@@ -40,9 +37,16 @@ def transform_data(df):
             "terminal_type",
         ]
     ]
-    terminals_df = terminals_df.drop_duplicates(subset="terminal_serial_number")
+    return terminals_df.drop_duplicates(subset="terminal_serial_number")
+
 
-    # Tabela de Pedidos (Orders) com a coluna adicional "is_business_day"
+def transform_orders(df):
+    """
+    Cria a tabela de pedidos, com a coluna adicional "is_business_day".
+
+    :param df: DataFrame com os dados extraídos da tabela "raw_data_orders".
+    :return: DataFrame da tabela Orders.
+    """
     orders_df = df[
         [
             "order_number",
@@ -61,28 +65,130 @@ def transform_data(df):
             "complement",
             "provider",
         ]
-    ]
+    ].copy()
+    orders_df["arrival_date"] = pd.to_datetime(
+        orders_df["arrival_date"], errors="coerce"
+    )
+    orders_df["deadline_date"] = pd.to_datetime(
+        orders_df["deadline_date"], errors="coerce"
+    )
 
     # Adiciona a coluna "is_business_day" que verifica se a data de chegada é um dia útil
     orders_df["is_business_day"] = orders_df["arrival_date"].apply(
         lambda x: pd.Timestamp(x).dayofweek < 5 and not pd.isnull(x)
     )
+    return orders_df
+
 
-    # Tabela de Clientes (Customers)
+def transform_customers(df):
+    """
+    Cria a tabela de clientes, com uma linha por cliente (a primeira encontrada).
+
+    :param df: DataFrame com os dados extraídos da tabela "raw_data_orders".
+    :return: DataFrame da tabela Customers.
+    """
     customers_df = df[
         [
             "customer_id",
             "customer_phone",
         ]
     ]
-    customers_df = customers_df.drop_duplicates(subset="customer_id")
+    return customers_df.drop_duplicates(subset="customer_id")
+
+
+# Tabelas com uma linha por chave, que precisam ser deduplicadas em todo o arquivo
+dimension_tables = {
+    "terminals": transform_terminals,
+    "customers": transform_customers,
+}
+
+
+def transform_data(df):
+    """
+    Transforma os dados extraídos do PostgreSQL em três tabelas separadas: Terminals, Orders e Customers.
 
+    :param df: DataFrame com os dados extraídos da tabela "raw_data_orders".
+    :return: Dicionário contendo os DataFrames transformados para Terminals, Orders e Customers.
+    """
     # Dicionário que agrupa as tabelas resultantes da transformação
     result_tables = {
-        "customers": customers_df,
-        "orders": orders_df,
-        "terminals": terminals_df,
+        "customers": transform_customers(df),
+        "orders": transform_orders(df),
+        "terminals": transform_terminals(df),
     }
 
     print("Tabelas criadas com sucesso")
     return result_tables
+
+
+def get_updated_keys(df, table_names, table_keys):
+    """
+    Lista, para cada tabela, as chaves dos registros derivados de linhas alteradas (modo CDC).
+
+    :param df: DataFrame com a coluna cdc_operation.
+    :param table_names: Tabelas para as quais as chaves são calculadas.
+    :param table_keys: Dicionário {tabela: coluna que identifica os registros}.
+    :return: Dicionário {tabela: lista de chaves a substituir}.
+    """
+    updated_rows = df[df[operation_column] == "update"]
+    return {
+        name: updated_rows[table_keys[name]].drop_duplicates().tolist()
+        for name in table_names
+    }
+
+
+def iter_transformed_data(new_data_parts, table_keys, n_partitions=None, cdc=False):
+    """
+    Transforma as partes carregadas no PostgreSQL e entrega as tabelas a carregar no BigQuery.
+
+    Sem particionamento, cada parte é transformada por inteiro com transform_data. Com as
+    partes vindas das partições em disco (por order_number), os pedidos são entregues parte
+    a parte, mas terminais e clientes são particionados novamente em disco pela sua própria
+    chave, para que cada chave seja entregue uma única vez com a primeira linha do arquivo,
+    como no caminho em memória.
+
+    :param new_data_parts: Iterável de DataFrames com as linhas carregadas no PostgreSQL.
+    :param table_keys: Dicionário {tabela: coluna que identifica os registros}.
+    :param n_partitions: Número de partições em disco, ou None se as partes não forem particionadas.
+    :param cdc: Se True, as partes contêm a coluna cdc_operation e são calculadas as chaves a substituir.
+    :return: Gerador de tuplas (dicionário de tabelas, dicionário de chaves a substituir).
+    """
+    if n_partitions is None:
+        for new_data in new_data_parts:
+            if new_data.empty:
+                logging.info("Nenhum dado novo para transformar.")
+                continue
+            tables = transform_data(new_data)
+            replace_keys = get_updated_keys(new_data, tables, table_keys) if cdc else {}
+            yield tables, replace_keys
+        return
+
+    partitioners = {
+        name: SpillPartitioner(table_keys[name], n_partitions)
+        for name in dimension_tables
+    }
+    try:
+        for new_data in new_data_parts:
+            if new_data.empty:
+                logging.info("Nenhum dado novo para transformar.")
+                continue
+            orders_df = transform_orders(new_data)
+            replace_keys = (
+                get_updated_keys(new_data, ["orders"], table_keys) if cdc else {}
+            )
+            yield {"orders": orders_df}, replace_keys
+
+            for name, partitioner in partitioners.items():
+                columns = list(dimension_tables[name](new_data.iloc[:0]).columns)
+                if cdc:
+                    columns.append(operation_column)
+                partitioner.add("left", new_data[columns])
+
+        for name, partitioner in partitioners.items():
+            for part in partitioner.apply(lambda left, right: left):
+                table_df = dimension_tables[name](part)
+                replace_keys = get_updated_keys(part, [name], table_keys) if cdc else {}
+                yield {name: table_df}, replace_keys
+    finally:
+        for partitioner in partitioners.values():
+            partitioner.cleanup()
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+from services.batching import AdaptiveBatchSizer, load_batch_state
+
+
+class TestAdaptiveBatchSizer(unittest.TestCase):
+    """
+    Classe de testes para o AdaptiveBatchSizer, responsável por ajustar o tamanho dos lotes
+    de inserção a partir da vazão medida e lembrar o melhor tamanho por tabela.
+    """
+
+    def setUp(self):
+        """
+        Cria um diretório temporário para o arquivo de estado e um DataFrame de exemplo.
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state_path = os.path.join(self.tmp_dir.name, "batch_sizes.json")
+        self.df = pd.DataFrame({"order_number": range(1000), "city": ["CityA"] * 1000})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_run_inserts_all_rows_in_order(self):
+        """
+        Testa se todas as linhas são entregues à função de inserção, na ordem e sem repetição.
+        """
+        batches = []
+        sizer = AdaptiveBatchSizer(
+            "orders", initial_size=10, min_size=10, state_path=self.state_path
+        )
+        inserted = sizer.run(self.df, batches.append)
+
+        self.assertEqual(inserted, len(self.df))
+        pd.testing.assert_frame_equal(pd.concat(batches), self.df)
+
+    def test_batch_size_grows_while_throughput_improves(self):
+        """
+        Testa se o lote cresce enquanto a vazão melhora.
+        """
+        sizer = AdaptiveBatchSizer(
+            "orders", initial_size=100, min_size=10, state_path=self.state_path
+        )
+        sizer.record(100, 1.0)
+        self.assertEqual(sizer.batch_size, 200)
+        sizer.record(200, 1.0)
+        self.assertEqual(sizer.batch_size, 400)
+
+    def test_batch_size_shrinks_when_throughput_drops(self):
+        """
+        Testa se o lote recua quando a vazão piora ou a latência passa do alvo.
+        """
+        sizer = AdaptiveBatchSizer(
+            "orders",
+            initial_size=100,
+            min_size=10,
+            target_latency=5.0,
+            state_path=self.state_path,
+        )
+        sizer.record(100, 1.0)
+        sizer.record(200, 4.0)
+        self.assertEqual(sizer.batch_size, 100)
+
+        sizer.record(100, 10.0)
+        self.assertEqual(sizer.batch_size, 50)
+
+    def test_limit_respects_parameter_count_and_memory(self):
+        """
+        Testa se o limite do lote respeita o número máximo de parâmetros e o orçamento de memória.
+        """
+        sizer = AdaptiveBatchSizer(
+            "orders", min_size=1, max_params=100, state_path=self.state_path
+        )
+        self.assertEqual(sizer.compute_limit(self.df), 50)
+
+        row_bytes = self.df.memory_usage(index=False, deep=True).sum() / len(self.df)
+        sizer = AdaptiveBatchSizer(
+            "orders",
+            min_size=1,
+            memory_budget_bytes=int(row_bytes * 20),
+            state_path=self.state_path,
+        )
+        self.assertEqual(sizer.compute_limit(self.df), 20)
+
+    def test_parameter_limit_overrides_min_size(self):
+        """
+        Testa se o limite de parâmetros é respeitado mesmo quando fica abaixo do tamanho mínimo.
+        """
+        wide_df = pd.DataFrame([range(1000)] * 10)
+        sizer = AdaptiveBatchSizer(
+            "orders", min_size=100, max_params=65535, state_path=self.state_path
+        )
+        self.assertEqual(sizer.compute_limit(wide_df), 65)
+
+        batches = []
+        sizer.run(wide_df, batches.append)
+        self.assertTrue(all(len(batch) * 1000 <= 65535 for batch in batches))
+
+    def test_best_size_is_remembered_across_runs(self):
+        """
+        Testa se o melhor tamanho observado é persistido e usado como ponto de partida na próxima execução.
+        """
+        sizer = AdaptiveBatchSizer(
+            "orders", initial_size=100, min_size=10, state_path=self.state_path
+        )
+        sizer.record(100, 1.0)
+        sizer.record(200, 1.0)
+        sizer.record(400, 4.0)
+        sizer.save()
+
+        self.assertEqual(load_batch_state(self.state_path)["orders"]["batch_size"], 200)
+        self.assertEqual(
+            AdaptiveBatchSizer("orders", state_path=self.state_path).batch_size, 200
+        )
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner(verbosity=2)
+    unittest.main(testRunner=runner)
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from services.cdc import classify_changes, compute_row_hash
+
+
+class TestCdc(unittest.TestCase):
+    """
+    Classe de testes para o modo CDC, responsável por calcular o hash de cada linha e classificar
+    as linhas de um arquivo em novas, alteradas e inalteradas.
+    """
+
+    def setUp(self):
+        """
+        Configura os dados de exemplo que serão usados nos testes.
+        """
+        self.df = pd.DataFrame(
+            {
+                "order_number": [1001, 1002, 1003],
+                "cancellation_reason": [None, "Customer request", None],
+                "deadline_date": ["2024-02-01", "2024-02-02", "2024-02-03"],
+            }
+        )
+        self.df["row_hash"] = compute_row_hash(self.df)
+
+    def test_hash_is_stable_and_ignores_column_order(self):
+        """
+        Testa se o hash é o mesmo para os mesmos dados, independentemente da ordem das colunas.
+        """
+        reordered = self.df[["deadline_date", "order_number", "cancellation_reason"]]
+        pd.testing.assert_series_equal(compute_row_hash(reordered), self.df["row_hash"])
+
+    def test_hash_changes_when_values_change(self):
+        """
+        Testa se o hash muda quando um valor corrigido é entregue.
+        """
+        corrected = self.df.drop(columns=["row_hash"])
+        corrected.loc[0, "cancellation_reason"] = "Duplicated order"
+        hashes = compute_row_hash(corrected)
+
+        self.assertNotEqual(hashes[0], self.df["row_hash"][0])
+        self.assertEqual(hashes[1], self.df["row_hash"][1])
+
+    def test_classify_changes(self):
+        """
+        Testa se as linhas são classificadas em insert, update e unchanged, tratando linhas
+        antigas sem hash como alteradas.
+        """
+        existing_df = pd.DataFrame(
+            {
+                "order_number": [1001, 1002],
+                "row_hash": pd.Series([self.df["row_hash"][0], None], dtype="Int64"),
+            }
+        )
+        result = classify_changes(self.df, existing_df)
+
+        self.assertEqual(
+            result["cdc_operation"].tolist(), ["unchanged", "update", "insert"]
+        )
+
+    def test_redelivery_without_nulls_is_unchanged(self):
+        """
+        Testa se uma reentrega sem nulos em uma coluna inteira não é classificada como alterada,
+        embora o pyarrow leia a coluna como float64 no arquivo original (que tinha nulos).
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            original_file = os.path.join(tmp_dir, "original.parquet")
+            redelivery_file = os.path.join(tmp_dir, "redelivery.parquet")
+            pq.write_table(
+                pa.table({"order_number": [1, 2, 3], "zip_code": [100, 200, None]}),
+                original_file,
+            )
+            pq.write_table(
+                pa.table({"order_number": [1, 2], "zip_code": [100, 200]}),
+                redelivery_file,
+            )
+            original_df = pd.read_parquet(original_file)
+            redelivery_df = pd.read_parquet(redelivery_file)
+
+        existing_df = pd.DataFrame(
+            {
+                "order_number": original_df["order_number"],
+                "row_hash": compute_row_hash(original_df).astype("Int64"),
+            }
+        )
+        redelivery_df["row_hash"] = compute_row_hash(redelivery_df)
+        result = classify_changes(redelivery_df, existing_df)
+
+        self.assertEqual(original_df["zip_code"].dtype, "float64")
+        self.assertEqual(result["cdc_operation"].tolist(), ["unchanged", "unchanged"])
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner(verbosity=2)
+    unittest.main(testRunner=runner)
@@ -0,0 +1,162 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from services.cdc import classify_changes, compute_row_hash
+from services.spill import (
+    SpillPartitioner,
+    estimate_parquet_memory,
+    iter_parquet_chunks,
+)
+
+
+class TestSpill(unittest.TestCase):
+    """
+    Classe de testes para o modo fora da memória, garantindo que os operadores particionados
+    em disco produzam o mesmo resultado que o caminho em memória, uma partição por vez.
+    """
+
+    def setUp(self):
+        """
+        Configura os dados de exemplo e um diretório temporário para as partições.
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.df = pd.DataFrame(
+            {
+                "order_number": range(1000, 1200),
+                "customer_id": [i % 37 for i in range(200)],
+                "customer_phone": [f"555-{i:04d}" for i in range(200)],
+                "cancellation_reason": [
+                    None if i % 3 else "Customer request" for i in range(200)
+                ],
+            }
+        )
+        self.existing_df = pd.DataFrame({"order_number": range(1050, 1300, 2)})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_partitioned_filter_matches_in_memory(self):
+        """
+        Testa se o filtro de registros existentes, aplicado partição a partição, entrega
+        as mesmas linhas e índices que o filtro em memória, sem repetir chaves entre partições.
+        """
+        expected = self.df[
+            ~self.df["order_number"].isin(self.existing_df["order_number"])
+        ]
+
+        with SpillPartitioner("order_number", 7, self.tmp_dir.name) as partitioner:
+            for start in range(0, len(self.df), 30):
+                partitioner.add("left", self.df.iloc[start : start + 30])
+            for start in range(0, len(self.existing_df), 17):
+                partitioner.add("right", self.existing_df.iloc[start : start + 17])
+
+            parts = list(
+                partitioner.apply(
+                    lambda left, right: left[
+                        ~left["order_number"].isin(right["order_number"])
+                    ]
+                )
+            )
+
+        self.assertGreater(len(parts), 1)
+        keys = [set(part["order_number"]) for part in parts]
+        self.assertEqual(sum(len(k) for k in keys), len(set().union(*keys)))
+        pd.testing.assert_frame_equal(pd.concat(parts).sort_index(), expected)
+
+    def test_partitions_are_removed_after_use(self):
+        """
+        Testa se os arquivos temporários das partições são removidos ao final.
+        """
+        with SpillPartitioner("customer_id", 3, self.tmp_dir.name) as partitioner:
+            partitioner.add("left", self.df)
+            self.assertNotEqual(os.listdir(partitioner.directory), [])
+
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    def test_spill_directory_is_read_from_environment(self):
+        """
+        Testa se ELT_SPILL_DIR é lido na criação do particionador, e não na importação do módulo.
+        """
+        with patch.dict(os.environ, {"ELT_SPILL_DIR": self.tmp_dir.name}):
+            with SpillPartitioner("order_number", 2) as partitioner:
+                self.assertEqual(
+                    os.path.dirname(partitioner.directory), self.tmp_dir.name
+                )
+
+    def test_parquet_chunks_match_read_parquet(self):
+        """
+        Testa se a leitura do parquet em blocos reproduz os dados e o índice de pd.read_parquet.
+        """
+        parquet_file = os.path.join(self.tmp_dir.name, "orders.parquet")
+        self.df.to_parquet(parquet_file)
+
+        result = pd.concat(iter_parquet_chunks(parquet_file, 64))
+
+        pd.testing.assert_frame_equal(result, pd.read_parquet(parquet_file))
+
+    def test_spilled_cdc_matches_in_memory(self):
+        """
+        Testa se o CDC aplicado partição a partição classifica as linhas como o caminho em
+        memória quando uma coluna inteira só tem nulos no último bloco do arquivo.
+        """
+        parquet_file = os.path.join(self.tmp_dir.name, "orders.parquet")
+        zip_codes = list(range(10000, 10200))
+        zip_codes[-1] = None
+        pq.write_table(
+            pa.table(
+                {
+                    "order_number": list(range(1000, 1200)),
+                    "zip_code": zip_codes,
+                    "is_paid": [i % 2 == 0 for i in range(199)] + [None],
+                }
+            ),
+            parquet_file,
+        )
+        in_memory_df = pd.read_parquet(parquet_file)
+        existing_df = pd.DataFrame(
+            {
+                "order_number": in_memory_df["order_number"],
+                "row_hash": compute_row_hash(in_memory_df).astype("Int64"),
+            }
+        )
+
+        def classify(left, right):
+            left = left.copy()
+            left["row_hash"] = compute_row_hash(left)
+            return classify_changes(left, right)
+
+        with SpillPartitioner("order_number", 64, self.tmp_dir.name) as partitioner:
+            chunks = list(iter_parquet_chunks(parquet_file, 20))
+            for chunk in chunks:
+                partitioner.add("left", chunk)
+            partitioner.add("right", existing_df)
+            result = pd.concat(partitioner.apply(classify)).sort_index()
+
+        pd.testing.assert_series_equal(chunks[0].dtypes, in_memory_df.dtypes)
+        self.assertEqual(len(result), len(in_memory_df))
+        self.assertEqual(set(result["cdc_operation"]), {"unchanged"})
+
+    def test_estimate_uses_pandas_memory(self):
+        """
+        Testa se a estimativa de memória reflete o tamanho do DataFrame no pandas,
+        e não o tamanho descomprimido do parquet.
+        """
+        parquet_file = os.path.join(self.tmp_dir.name, "orders.parquet")
+        self.df.to_parquet(parquet_file)
+        actual_bytes = (
+            pd.read_parquet(parquet_file).memory_usage(index=True, deep=True).sum()
+        )
+
+        estimated_bytes, n_rows = estimate_parquet_memory(parquet_file)
+
+        self.assertEqual(n_rows, len(self.df))
+        self.assertAlmostEqual(estimated_bytes / actual_bytes, 1, delta=0.05)
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner(verbosity=2)
+    unittest.main(testRunner=runner)
@@ -1,6 +1,6 @@
 import unittest
 import pandas as pd
-from services.transformations.main import transform_data
+from services.transformations.main import iter_transformed_data, transform_data
 
 
 class TestTransformData(unittest.TestCase):
@@ -100,6 +100,53 @@ class TestTransformData(unittest.TestCase):
             result_tables["customers"], self.expected_customers_df
         )
 
+    def test_partitioned_dimensions_keep_first_row_in_file(self):
+        """
+        Testa se, com as partes vindas das partições em disco, terminais e clientes são entregues
+        uma única vez por chave, com a primeira linha do arquivo (e não da primeira partição),
+        e se no modo CDC as chaves de linhas alteradas são substituídas.
+        """
+        df = pd.concat([self.df] * 3, ignore_index=True)
+        df["order_number"] = range(1001, 1007)
+        df["customer_phone"] = [f"555-{i:04d}" for i in range(6)]
+        df["cdc_operation"] = [
+            "insert",
+            "insert",
+            "insert",
+            "update",
+            "insert",
+            "insert",
+        ]
+        table_keys = {
+            "orders": "order_number",
+            "terminals": "terminal_serial_number",
+            "customers": "customer_id",
+        }
+
+        # As partes chegam fora da ordem do arquivo, como as partições por order_number
+        parts = [df.iloc[[4, 5]], df.iloc[[1, 3]], df.iloc[[0, 2]]]
+        results = list(
+            iter_transformed_data(parts, table_keys, n_partitions=3, cdc=True)
+        )
+
+        tables = {}
+        replace_keys = {}
+        for result_tables, result_keys in results:
+            for name, table_df in result_tables.items():
+                tables.setdefault(name, []).append(table_df)
+            for name, keys in result_keys.items():
+                replace_keys.setdefault(name, []).extend(keys)
+        expected = transform_data(df.drop(columns=["cdc_operation"]))
+
+        for name in ["customers", "terminals"]:
+            pd.testing.assert_frame_equal(
+                pd.concat(tables[name]).sort_index(), expected[name]
+            )
+        self.assertEqual(len(pd.concat(tables["orders"])), len(expected["orders"]))
+        self.assertEqual(replace_keys["orders"], [1004])
+        self.assertEqual(replace_keys["customers"], [2])
+        self.assertEqual(replace_keys["terminals"], ["SN456"])
+
 
 if __name__ == "__main__":
     # Executa os testes com saída detalhada